@@ -14,19 +14,20 @@ from virtual_courier import VirtualCourierArchive
 
 
 project_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
-connect_token = dotenv_values(os.path.join(project_dir, ".env"))["VC_CONNECT_TOKEN"]
+env = dotenv_values(os.path.join(project_dir, ".env"))
+connect_token = env["VC_CONNECT_TOKEN"]
+bot_token = env["VC_BOT_TOKEN"]
 app = App(token=connect_token)
+# Shared by every event so that connections to Slack are reused
+client = WebClient(token=bot_token, timeout=180)
 
 
 @app.event("app_mention")
 def handle_app_mention_events(body):
     print("Mentioned!")
-    bot_token = dotenv_values(os.path.join(project_dir, ".env"))["VC_BOT_TOKEN"]
-    client = WebClient(token=bot_token, timeout=180)
     msg_txt = "Working on it! I'll send a CSV and PDF in a few minutes."
     client.chat_postMessage(channel=body["event"]["channel"], text=msg_txt)
     arch = VirtualCourierArchive(client, output_dir=os.getcwd(), event=body["event"])
-    arch.download_files()
     arch.make_csv()
     arch.make_pdf()
     arch.post("csv")
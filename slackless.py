@@ -38,7 +38,8 @@ if __name__ == "__main__":
 
     os.chdir(project_dir)
     arch = VirtualCourierArchive(client, output_dir_abs, channel_name=channel_name)
-    arch.download_files()
+    if '-keep' in sys.argv:
+        arch.download_files()
     arch.make_csv()
     arch.make_pdf()
     if '-post' in sys.argv:
@@ -48,4 +49,5 @@ if __name__ == "__main__":
         arch.cleanup()
     if '-json' in sys.argv:
         with open(os.path.join(arch.output_dir, f"{arch.channel_name}.json"), 'w') as f:
-            json.dump(arch._raw_history.data, f)
+            # Same order as conversations.history, newest message first
+            json.dump({"ok": True, "messages": list(reversed(arch._raw_history)), "has_more": False}, f)
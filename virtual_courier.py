@@ -6,20 +6,41 @@ is to parse and store the message history of a Slack channel. It also contains h
 import json
 import re
 import requests
+import urllib3
 import os
-from datetime import (datetime, timedelta)
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from datetime import (datetime, timezone)
 from csv import DictWriter
-from shutil import rmtree
-from fpdf import FPDF
+from shutil import (copyfile, copyfileobj, rmtree)
+from io import BytesIO
+from fpdf import (FPDF, FPDFException, XPos, YPos)
+from PIL import Image
 from slack_sdk.errors import SlackApiError
 from urllib.error import URLError
 
+USER_CACHE_TTL = 600  # seconds
+CHANNEL_CACHE_TTL = 86400  # seconds
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes
+USER_LOOKUP_WORKERS = 5  # concurrent users.info requests, kept low to stay under Slack's rate limits
+IMAGE_PREFETCH_COUNT = 4  # images make_pdf downloads ahead of the one it is printing
+PDF_IMAGE_WIDTH = 600  # pixels; images are printed 2.6 inches wide
+PDF_IMAGE_QUALITY = 80  # JPEG quality of images embedded in the PDF
+_USER_RE = re.compile(r"<@([A-Za-z0-9]+)>")
+# Unicode characters that aren't recognized in latin-1 encoding
+_UNICODE_TRANS = str.maketrans({"\u2019": "'", "\u2026": "..."})
+_project_dir = os.path.dirname(os.path.abspath(__file__))
+_channel_id_cache_path = os.path.join(_project_dir, ".channel_cache.json")
+_user_cache_path = os.path.join(_project_dir, ".user_cache.json")
+# Folders searched for the DejaVu Sans font files used to print Unicode text in the PDF
+_pdf_font_dirs = [os.path.join(_project_dir, "fonts"), "/usr/share/fonts/truetype/dejavu"]
+
 
 def epoch_to_datetime(ts):
-    """Given a timestamp in epoch format, returns a datetime"""
-    epoch = datetime(1970, 1, 1)
-    timestamp = epoch + timedelta(seconds=float(ts))
-    return timestamp
+    """Given a timestamp in epoch format, returns a datetime in UTC"""
+    return datetime.fromtimestamp(float(ts), tz=timezone.utc)
 
 
 def get_timestamp(ts):
@@ -30,16 +51,145 @@ def get_timestamp(ts):
     return str(timestamp)
 
 
-def unique_filename(orig_filename, file_list):
+def unique_filename(orig_filename, file_set, counters=None):
+    """Returns orig_filename, or orig_filename with " (n)" added before the extension if it is already in file_set.
+    counters maps each filename to the last n used for it, so that a repeated filename isn't probed from 1 again."""
+    if orig_filename not in file_set:
+        return orig_filename
+    if counters is None:
+        counters = {}
     filename, ext = os.path.splitext(orig_filename)
-    split_filename = filename
-    if ext is None:
-        ext = ''
-    counter = 1
-    while filename + ext in file_list:
-        filename = split_filename + " (" + str(counter) + ")"
+    counter = counters.get(orig_filename, 0)
+    new_filename = orig_filename
+    while new_filename in file_set:
         counter += 1
-    return filename + ext
+        new_filename = f"{filename} ({counter}){ext}"
+    counters[orig_filename] = counter
+    return new_filename
+
+
+def _stream_to(session, url, f, retry_count=3, retry_delay=1):
+    """Streams the file at url into the binary file object f. Retries on connection errors, HTTP 429 and 5xx
+    responses, waiting for Retry-After seconds when Slack provides it. Returns True if the download succeeded."""
+    for attempt in range(retry_count + 1):
+        delay = retry_delay
+        try:
+            with session.get(url, stream=True) as response:
+                if response.ok:
+                    # Let urllib3 undo any gzip or deflate content encoding while streaming
+                    response.raw.decode_content = True
+                    # Drop anything written by an attempt that failed partway through
+                    f.seek(0)
+                    f.truncate()
+                    copyfileobj(response.raw, f, DOWNLOAD_CHUNK_SIZE)
+                    return True
+                if response.status_code == 429:
+                    delay = float(response.headers.get("Retry-After", retry_delay))
+                elif response.status_code < 500:
+                    return False
+        except (requests.RequestException, urllib3.exceptions.HTTPError):
+            pass
+        if attempt < retry_count:
+            time.sleep(delay)
+    return False
+
+
+def _download_one(session, url, filepath, retry_count=3, retry_delay=1):
+    """Streams the file at url to filepath. Returns a tuple of (filepath, ok)."""
+    with open(filepath, "wb") as f:
+        ok = _stream_to(session, url, f, retry_count, retry_delay)
+    if not ok:
+        os.remove(filepath)
+    return filepath, ok
+
+
+def _read_cache(path):
+    """Returns the contents of the JSON cache file at path, or None if it is missing or unreadable."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(path, data):
+    """Saves data to the JSON cache file at path. Failing to write the cache is not an error."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(data, f)
+    except OSError:
+        pass
+
+
+def _user_name(user_data):
+    """Given a user object from the Slack API, returns the user's real name, or the user name
+    if the real name is missing or the user has been deactivated."""
+    user_name = user_data.get("profile", {}).get("real_name")
+    if user_name is None or user_name == "Deactivated User":
+        user_name = user_data["name"]
+    return user_name
+
+
+def _iter_pages(method, key, **kwargs):
+    """Yields the items listed under key on every page returned by a paginated Slack API method.
+    Slack marks the last page with a missing or empty next_cursor. Pages are only requested as they are consumed,
+    so a caller that stops iterating early doesn't fetch the remaining pages."""
+    cursor = None
+    while True:
+        response = method(cursor=cursor, **kwargs).data
+        yield from response[key]
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            return
+
+
+@lru_cache(maxsize=1)
+def _load_all_users(client, ttl_hash):
+    """Returns a dictionary of user_id : user_name for every user in the workspace.
+    ttl_hash changes every USER_CACHE_TTL seconds so that the cached result expires."""
+    users = _iter_pages(client.users_list, "members", limit=1000)
+    return {user_data["id"]: _user_name(user_data) for user_data in users}
+
+
+def _add_unicode_font(pdf):
+    """Registers DejaVu Sans with pdf and returns its family name, or returns None if the font files aren't found."""
+    for font_dir in _pdf_font_dirs:
+        regular = os.path.join(font_dir, "DejaVuSans.ttf")
+        bold = os.path.join(font_dir, "DejaVuSans-Bold.ttf")
+        if os.path.exists(regular) and os.path.exists(bold):
+            pdf.add_font("DejaVu", "", regular)
+            pdf.add_font("DejaVu", "B", bold)
+            return "DejaVu"
+    return None
+
+
+def _prepare_image(image):
+    """Given the path or file object of an image, returns the image to embed in the PDF. Images no wider than
+    PDF_IMAGE_WIDTH pixels are returned unchanged. Wider images are scaled down into a BytesIO; JPEGs are saved as
+    JPEGs, and other images as PNGs so that screenshots of text and transparency aren't degraded."""
+    with Image.open(image) as img:
+        if img.width <= PDF_IMAGE_WIDTH:
+            if hasattr(image, "seek"):
+                image.seek(0)
+            return image
+        is_jpeg = img.format == "JPEG"
+        if img.mode in ("1", "P"):
+            # Palette images can't be resampled smoothly
+            img = img.convert("RGBA")
+        img.thumbnail((PDF_IMAGE_WIDTH, 10000), Image.LANCZOS)
+        image_buffer = BytesIO()
+        if is_jpeg:
+            img.save(image_buffer, "JPEG", quality=PDF_IMAGE_QUALITY, optimize=True)
+        else:
+            img.save(image_buffer, "PNG", optimize=True)
+    image_buffer.seek(0)
+    return image_buffer
+
+
+def _latin1(text):
+    """Escapes characters that the core PDF fonts can't print, which only support latin-1."""
+    return text.encode('latin-1', 'backslashreplace').decode('latin-1')
 
 
 class VirtualCourierArchive:
@@ -48,43 +198,72 @@ class VirtualCourierArchive:
     client: a WebClient object from the slack_bolt package.
     channel_name: use this parameter if not running with an event listener.
     event: body["event"], where body is the response from an event listener.
+    max_workers: the number of threads used to download files in parallel.
+    retry_count: the number of times a failed download is retried.
+    retry_delay: the number of seconds to wait between retries, unless Slack sends a Retry-After header.
 
     If channel_name is not None, then event should be None.
     If event is not None, then channel_name should be None.
     """
 
-    def __init__(self, client, output_dir, channel_name=None, event=None):
+    def __init__(self, client, output_dir, channel_name=None, event=None, max_workers=8, retry_count=3,
+                 retry_delay=1):
         if channel_name is None and event is None:
             err_msg = "Either channel_name or event must not be None"
             raise RuntimeError(err_msg)
         self.client = client
+        self.max_workers = max_workers
+        self.retry_count = retry_count
+        self.retry_delay = retry_delay
+        # One session is used for every file download so that connections to Slack are reused
+        self._http = requests.Session()
+        self._http.headers["Authorization"] = f"Bearer {client.token}"
+        self._http.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max_workers))
+        self._channel_cache = _read_cache(_channel_id_cache_path) or {}
         self._set_channel_id(channel_name, event)
         self._set_channel_name(channel_name, event)
         self._set_output_dir(output_dir)
-        # Get the channel history
-        self._raw_history = self._get_channel_history(self.channel_id)
+        # Get the channel history, oldest message first
+        self._raw_history = self._get_channel_history()
         # Set member names for each user that sent a message to the channel
         self._set_members()
         # Set the name of the user who is performing this export
         self._set_user(event)
         self._set_timestamp(event)
+        # date : (display date, CSV date), filled in by _parse_message
+        self._date_strings = {}
         self._set_messages()
 
     def _set_channel_id(self, channel_name, event):
         if event is not None:
             channel_id = event["channel"]
         else:
-            try:
-                response_public = self.client.conversations_list(types="public_channel", exclude_archived=False).data
-                response_private = self.client.conversations_list(types="private_channel", exclude_archived=False).data
-                channels = response_public["channels"] + response_private["channels"]
-                channel = list(filter(lambda c: c["name"].lower() == channel_name.lower(), channels))[0]
-                channel_id = channel["id"]
-            except (IndexError, SlackApiError):
-                err_msg = f"Channel id not found for {channel_name}"
-                raise RuntimeError(err_msg)
+            err_msg = f"Channel id not found for {channel_name}"
+            key = channel_name.lower()
+            cached = self._channel_cache.get(key)
+            if cached is not None and time.time() - cached["timestamp"] < CHANNEL_CACHE_TTL:
+                channel_id = cached["id"]
+            else:
+                try:
+                    channel_id = self._find_channel_id(key)
+                except SlackApiError:
+                    raise RuntimeError(err_msg)
+                if channel_id is None:
+                    raise RuntimeError(err_msg)
+                self._channel_cache[key] = {"id": channel_id, "timestamp": time.time()}
+                _write_cache(_channel_id_cache_path, self._channel_cache)
         self.channel_id = channel_id
 
+    def _find_channel_id(self, channel_name):
+        """Returns the id of the channel whose lowercase name is channel_name, or None if it isn't found.
+        Stops paging through the channel list as soon as the channel is found."""
+        channels = _iter_pages(self.client.conversations_list, "channels", types="public_channel,private_channel",
+                               exclude_archived=False, limit=1000)
+        for channel in channels:
+            if channel["name"].lower() == channel_name:
+                return channel["id"]
+        return None
+
     def _set_channel_name(self, channel_name, event):
         if event is not None:
             try:
@@ -102,51 +281,65 @@ class VirtualCourierArchive:
             output_dir = os.path.join(output_dir, f"{self.channel_name.title()} Archive")
         self.output_dir = output_dir
 
-    def _get_channel_history(self, channel_id):
-        """Returns json of channel history."""
-        client = self.client
+    def _iter_history(self):
+        """Returns an iterator over the messages sent in the channel, newest first, fetching up to 1000 messages
+        per request."""
+        return _iter_pages(self.client.conversations_history, "messages", channel=self.channel_id, limit=1000)
+
+    def _get_channel_history(self):
+        """Returns a deque of the raw messages sent in the channel, oldest first."""
+        history = deque()
         try:
-            response_parent = client.conversations_history(channel=channel_id)
-            response = response_parent
-            while response.data["has_more"]:
-                next = response.data["response_metadata"]["next_cursor"]
-                response = client.conversations_history(channel=channel_id, cursor=next)
-                response_parent.data["messages"] += response.data["messages"]
-            if "response_metadata" in response_parent.data.keys():
-                response_parent.data.pop("response_metadata")
-                response_parent.data["has_more"] = False
-            return response_parent
+            for message in self._iter_history():
+                history.appendleft(message)
         except SlackApiError as e:
             print("Error while fetching the conversation history")
             raise e
+        return history
 
     def _set_members(self):
         """Given the conversation history of a channel, returns a dictionary of user_id : user_name."""
-        messages = self._raw_history["messages"]
-        users = []
-        for message in messages:
-            user = message.get("user")
-            if user is not None and user not in users:
-                users.append(user)
-        user_dict = {}
-        for user in users:
+        users = {message["user"] for message in self._raw_history if message.get("user") is not None}
+        all_users = self._get_all_users()
+        user_dict = {user: all_users[user] for user in users if user in all_users}
+        # Users created after the user cache was filled are looked up individually, a few at a time
+        missing_users = [user for user in users if user not in user_dict]
+        if len(missing_users) > 0:
+            with ThreadPoolExecutor(max_workers=USER_LOOKUP_WORKERS) as ex:
+                user_dict.update(ex.map(self._fetch_user_name, missing_users))
+        self.members = user_dict
+
+    def _fetch_user_name(self, user):
+        """Returns a tuple of (user_id, user_name) for a single user from users.info. When Slack rate limits
+        the request, waits for Retry-After seconds and tries again."""
+        for attempt in range(self.retry_count + 1):
             try:
                 user_response = self.client.users_info(user=user)
                 user_data = user_response.data["user"]
-                try:
-                    user_name = user_data["profile"]["real_name"]
-                    if user_name == "Deactivated User":
-                        user_name = user_data["name"]
-                except KeyError:
+                if user_data.get("profile", {}).get("real_name") is None:
                     with open("user_log.json", "a") as f:
                         json.dump(user_response.data, f)
-                    user_name = user_data["name"]
-                user_dict[user] = user_name
-            except SlackApiError:
+                return user, _user_name(user_data)
+            except SlackApiError as e:
+                if e.response is not None and e.response.status_code == 429 and attempt < self.retry_count:
+                    time.sleep(float(e.response.headers.get("Retry-After", self.retry_delay)))
+                    continue
                 with open("user_log.txt", "a") as f:
                     f.write(f"error: {user}")
-                user_dict[user] = user
-        self.members = user_dict
+                return user, user
+
+    def _get_all_users(self):
+        """Returns a dictionary of user_id : user_name for every user in the workspace. The result is cached
+        next to this module and reused for USER_CACHE_TTL seconds."""
+        cache = _read_cache(_user_cache_path)
+        if cache is not None and time.time() - cache.get("timestamp", 0) < USER_CACHE_TTL:
+            return cache["users"]
+        try:
+            users = _load_all_users(self.client, int(time.time() // USER_CACHE_TTL))
+        except SlackApiError:
+            return {}
+        _write_cache(_user_cache_path, {"timestamp": time.time(), "users": users})
+        return users
 
     def _set_user(self, event):
         # If event is not None, get the name of the user who triggered the event and the time it was triggered.
@@ -165,21 +358,19 @@ class VirtualCourierArchive:
 
     def _set_messages(self):
         """Returns parsed messages that were sent in the channel."""
-        messages_raw = self._raw_history["messages"]
-        messages_list = []
-        for ind, message in enumerate(reversed(messages_raw)):
-            message_dict = self._parse_message(message, ind + 1)
-            messages_list.append(message_dict)
-        self.messages = messages_list
+        self.messages = [self._parse_message(message, ind) for ind, message in enumerate(self._raw_history, 1)]
 
     def _parse_message(self, message, message_id):
         """Returns pertinent information about a message."""
         files = []
         if "files" in message.keys():
+            filenames = set()
+            filename_counters = {}
             for file in message["files"]:
                 filename_original = file.get("name")
                 filename_modified = filename_original if filename_original is not None else "Unknown"
-                filename = unique_filename(filename_modified, [f["filename"] for f in files])
+                filename = unique_filename(filename_modified, filenames, filename_counters)
+                filenames.add(filename)
                 url_download = file.get("url_private_download")
                 url = file.get("url_private")
                 files.append({
@@ -199,7 +390,13 @@ class VirtualCourierArchive:
             user = self.members.get(raw_user)
             if user is None:
                 user = raw_user
-        timestamp = epoch_to_datetime(message["ts"])
+        dt = datetime.fromtimestamp(float(message["ts"]), tz=timezone.utc)
+        # Messages are often sent on the same day, so the date strings are formatted once per day
+        date_display, date_csv = self._date_strings.get(dt.date()) or self._format_date(dt)
+        hour = dt.hour % 12 or 12
+        am_pm = "AM" if dt.hour < 12 else "PM"
+        timestamp_display = f"{date_display} at {hour:02d}:{dt.minute:02d} {am_pm}"
+        timestamp_csv = f"{date_csv} {hour:02d}:{dt.minute:02d}{am_pm}"
         text = self._normalize_text(message.get("text"), possible_user_id=True)
         file_dir = os.path.join(self.output_dir, f"message_{message_id}")
         message_dict = {
@@ -210,38 +407,32 @@ class VirtualCourierArchive:
             "user": user,
             "files": files,
             "file_dir": file_dir,
-            "timestamp_display": timestamp.strftime("%m/%d/%Y at %I:%M %p"),
-            "timestamp": timestamp.strftime("%Y-%m-%d %I:%M%p")
+            "timestamp_display": timestamp_display,
+            "timestamp": timestamp_csv
             }
         return message_dict
 
+    def _format_date(self, dt):
+        """Returns the date of dt as a tuple of (mm/dd/yyyy, yyyy-mm-dd) strings and remembers it for later messages."""
+        date_strings = tuple(dt.strftime("%m/%d/%Y|%Y-%m-%d").split("|"))
+        self._date_strings[dt.date()] = date_strings
+        return date_strings
+
     def _normalize_text(self, text, possible_user_id = True):
         """When user name is known, inserts user name in place of user id in message text.
         Decodes unicode characters that aren't recognized in latin-1.
         If possible_user_id is set, look for user IDs and replace with user name if found."""
-        # Decode unicode character that isn't recognized in latin-1 encoding
-        text = text.replace("\u2019", "'")
-        text = text.replace("\u2026", "...")
+        text = text.translate(_UNICODE_TRANS)
         # Replace instances of user ID with user name.
         if possible_user_id:
-            pattern = r"<@[a-zA-Z0-9]*>"
-            result = re.search(pattern, text)
-            if result is not None:
-                result_text = result.group(0)
-                user_id = result_text[2:-1]
-                try:
-                    user_name = self.members[user_id]
-                except KeyError:
-                    user_name = user_id
-                replace_with = "@" + user_name
-                new_text = text.replace(result_text, replace_with)
-                return new_text
-            else:
-                return text
+            text = _USER_RE.sub(lambda m: "@" + self.members.get(m.group(1), m.group(1)), text)
+        return text
 
     def download_files(self):
         """Downloads the image files mentioned in the channel history."""
         supported_filetypes = tuple(['jpg', 'jpeg', 'png', 'gif'])
+        # download URL : (file, filepaths), so that a file attached more than once is only downloaded once
+        jobs = {}
         for message in self.messages:
             files = message["files"]
             if len(files) > 0:
@@ -254,33 +445,48 @@ class VirtualCourierArchive:
                         filepath = f"{file_dir}/{file['filename']}"
                         url = file["url_download"]
                         if url is not None:
-                            response = requests.get(url, headers={'Authorization': f'Bearer {self.client.token}'})
-                            if response is not None:
-                                with open(filepath, "wb") as f:
-                                    f.write(response.content)
+                            jobs.setdefault(url, (file, []))[1].append(filepath)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
+            results = list(ex.map(lambda job: self._download_file(job[0], job[1][0]), jobs.values()))
+        for (filepath, ok), (_, filepaths) in zip(results, jobs.values()):
+            if not ok:
+                print(f"Error while downloading {filepath}")
+                continue
+            for duplicate_path in filepaths[1:]:
+                copyfile(filepath, duplicate_path)
+
+    def _download_file(self, file, dest):
+        """Downloads a file from the channel history to dest. Returns a tuple of (dest, ok)."""
+        return _download_one(self._http, file["url_download"], dest, self.retry_count, self.retry_delay)
+
+    def _fetch_image(self, url):
+        """Downloads a file from the channel history into memory. Returns a BytesIO, or None if the download failed."""
+        image_buffer = BytesIO()
+        if not _stream_to(self._http, url, image_buffer, self.retry_count, self.retry_delay):
+            return None
+        image_buffer.seek(0)
+        return image_buffer
 
     def make_csv(self):
         """Create CSV of channel history."""
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
         filepath_abs = os.path.join(self.output_dir, f"{self.channel_name}.csv")
-        csv_list = []
-        for message in self.messages:
-            columns = ["sender", "timestamp", "text", "file"]
-            user = message["user"]
-            ts = message["timestamp"]
-            text = message["text"] if message["text"] is not None else ''
-            files = message["files"]
-            if len(files) > 0:
-                for file in files:
-                    url = file["url"]
-                    csv_list.append({"sender": user, "timestamp": ts, "text": text, "file": url})
-            else:
-                csv_list.append({"sender": user, "timestamp": ts, "text": text, "file": ''})
+        columns = ["sender", "timestamp", "text", "file"]
         with open(filepath_abs, 'w', encoding='utf-8-sig', newline='') as csvfile:
             writer = DictWriter(csvfile, fieldnames=columns)
             writer.writeheader()
-            writer.writerows(csv_list)
+            for message in self.messages:
+                user = message["user"]
+                ts = message["timestamp"]
+                text = message["text"] if message["text"] is not None else ''
+                files = message["files"]
+                if len(files) > 0:
+                    for file in files:
+                        url = file["url"]
+                        writer.writerow({"sender": user, "timestamp": ts, "text": text, "file": url})
+                else:
+                    writer.writerow({"sender": user, "timestamp": ts, "text": text, "file": ''})
             self.csv_filepath = filepath_abs
 
     def make_pdf(self):
@@ -290,54 +496,108 @@ class VirtualCourierArchive:
         filepath_abs = os.path.join(self.output_dir, f"{self.channel_name}.pdf")
         pdf = FPDF("P", "in", "letter")
         supported_filetypes = tuple(['jpg', 'jpeg', 'png', 'gif'])
+        font = _add_unicode_font(pdf)
+        # Without a Unicode font, text is escaped to latin-1 for the core Helvetica font
+        pdf_text = str if font is not None else _latin1
+        if font is None:
+            font = 'helvetica'
         pdf.add_page()
         pdf.set_margins(1, 1, 1)
-        pdf.set_font('Arial', '', 12)
+        pdf.set_font(font, '', 12)
         pdf.set_draw_color(0, 0, 0)
         pdf.set_line_width(0.01)
         col_width = pdf.w - 2 * pdf.l_margin
         col_height = pdf.font_size
         line_break = pdf.font_size
-        pdf.set_font('Arial', 'B', 12)
-        pdf.cell(col_width, col_height, f"{self.channel_name} Channel Archive".encode('latin-1','strict').decode('latin-1','strict'), ln=line_break)
-        pdf.set_font('Arial', '', 12)
-        pdf.cell(col_width, col_height, f"Exported on {self.timestamp}", ln=line_break)
+        pdf.set_font(font, 'B', 12)
+        pdf.cell(col_width, col_height, pdf_text(f"{self.channel_name} Channel Archive"), new_x=XPos.LMARGIN,
+                 new_y=YPos.NEXT)
+        pdf.set_font(font, '', 12)
+        pdf.cell(col_width, col_height, f"Exported on {self.timestamp}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         pdf.ln(line_break)
-        for message in self.messages:
-            user = message["user"]
-            ts = message["timestamp_display"]
-            file_dir = message["file_dir"]
-            if message["subtype"] == 'channel_join':
-                message_header = ts
-            else:
-                message_header = f"{user} on {ts}"
-            pdf.cell(col_width, col_height, message_header, ln=line_break)
-            if len(message["text"]) > 0:
-                message_text = message["text"].encode('latin-1', 'backslashreplace').decode('latin-1')
-                pdf.multi_cell(col_width, col_height, message_text)
-            if len(message["files"]) > 0:
-                for file in message["files"]:
-                    filename = self._normalize_text(file["filename"], possible_user_id=False)
-                    filepath = f"{file_dir}/{filename}"
-                    url = file["url"]
-                    if filepath.lower().endswith(supported_filetypes):
-                        try:
-                            pdf.image(filepath, w=col_width / 2.5)
-                            pdf.ln(line_break)
-                        except RuntimeError:
-                            self._put_link(pdf, col_width, col_height, f"File: {filename}", line_break, url)
-                    else:
-                        self._put_link(pdf, col_width, col_height, f"File: {filename}", line_break, url)
-            pdf.ln(line_break / 2)
-            y = pdf.get_y()
-            pdf.line(pdf.l_margin / 2, y, 8.5 - pdf.r_margin / 2, y)
-            pdf.ln(line_break / 2)
+        # Images that weren't saved by download_files are downloaded in the background, up to
+        # IMAGE_PREFETCH_COUNT images ahead of the one being printed, and are only kept in memory.
+        # Each download URL is fetched once, and its image is dropped after the last file that uses it is printed.
+        remote_urls = [file["url_download"] for message in self.messages for file in message["files"]
+                       if file["filename"].lower().endswith(supported_filetypes)
+                       and file["url_download"] is not None
+                       and not os.path.exists(f"{message['file_dir']}/{file['filename']}")]
+        # download URL : index of the last file in remote_urls that uses it, in order of first use
+        last_use = {url: ind for ind, url in enumerate(remote_urls)}
+        unfetched_urls = iter(last_use)
+        fetched_images = {}  # download URL : future of the downloaded BytesIO
+        remote_ind = 0
+        ex = ThreadPoolExecutor(max_workers=IMAGE_PREFETCH_COUNT)
+        # Values and methods used for every message are looked up once, outside the loop
+        image_width = col_width / 2.5
+        half_line = line_break / 2
+        separator_start = pdf.l_margin / 2
+        separator_end = 8.5 - pdf.r_margin / 2
+        multi_cell = pdf.multi_cell
+        pdf_ln = pdf.ln
+        try:
+            for message in self.messages:
+                user = message["user"]
+                ts = message["timestamp_display"]
+                file_dir = message["file_dir"]
+                if message["subtype"] == 'channel_join':
+                    message_header = ts
+                else:
+                    message_header = f"{user} on {ts}"
+                # The header and the message text are printed with a single call
+                if len(message["text"]) > 0:
+                    message_header = f"{message_header}\n{message['text']}"
+                multi_cell(col_width, col_height, pdf_text(message_header), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+                if len(message["files"]) > 0:
+                    for file in message["files"]:
+                        filename = pdf_text(self._normalize_text(file["filename"], possible_user_id=False))
+                        image = f"{file_dir}/{file['filename']}"
+                        url = file["url"]
+                        if image.lower().endswith(supported_filetypes):
+                            if not os.path.exists(image):
+                                url_download = file["url_download"]
+                                if url_download is None:
+                                    image = None
+                                else:
+                                    # URLs are fetched in order of first use, so this URL is either already
+                                    # fetched or the next one to fetch
+                                    while url_download not in fetched_images or \
+                                            len(fetched_images) < IMAGE_PREFETCH_COUNT:
+                                        next_url = next(unfetched_urls, None)
+                                        if next_url is None:
+                                            break
+                                        fetched_images[next_url] = ex.submit(self._fetch_image, next_url)
+                                    if last_use[url_download] == remote_ind:
+                                        image = fetched_images.pop(url_download).result()
+                                    else:
+                                        # Later files reuse the download, so they each get their own copy
+                                        image = fetched_images[url_download].result()
+                                        if image is not None:
+                                            image = BytesIO(image.getvalue())
+                                    remote_ind += 1
+                            if image is not None:
+                                try:
+                                    pdf.image(_prepare_image(image), w=image_width)
+                                    pdf_ln(line_break)
+                                except (OSError, FPDFException):
+                                    self._put_link(pdf, col_width, col_height, f"File: {filename}", url)
+                            else:
+                                self._put_link(pdf, col_width, col_height, f"File: {filename}", url)
+                        else:
+                            self._put_link(pdf, col_width, col_height, f"File: {filename}", url)
+                # Half a line of space, a separator line, and another half line of space
+                pdf_ln(half_line)
+                y = pdf.get_y()
+                pdf.line(separator_start, y, separator_end, y)
+                pdf_ln(half_line)
+        finally:
+            ex.shutdown(cancel_futures=True)
         pdf.output(filepath_abs)
         self.pdf_filepath = filepath_abs
 
-    def _put_link(self, pdf, col_width, col_height, text, ln, url):
+    def _put_link(self, pdf, col_width, col_height, text, url):
         pdf.set_text_color(6, 69, 173)  # hyperlink blue
-        pdf.cell(col_width, col_height, text, ln=ln, link=url)
+        pdf.cell(col_width, col_height, text, link=url, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         pdf.set_text_color(0, 0, 0)  # reset to black
 
     def post(self, format="csv"):
@@ -350,7 +610,9 @@ class VirtualCourierArchive:
             err_msg = "format parameter must be 'csv' or 'pdf'."
             raise RuntimeError(err_msg)
         try:
-            self.client.files_upload(channels=self.channel_id, file=fp, title=f"{self.channel_name} {format}")
+            # files_upload_v2 uploads straight to Slack's file storage. The file info isn't used, so it isn't requested.
+            self.client.files_upload_v2(channel=self.channel_id, file=fp, title=f"{self.channel_name} {format}",
+                                        request_file_info=False)
         except URLError as e:
             err_msg = "An error occurred while uploading the file to this channel. Contact <@U03F805UUDC> for support."
             self.client.chat_postMessage(channel=self.channel_id, text=err_msg)
@@ -358,8 +620,9 @@ class VirtualCourierArchive:
 
     def cleanup(self):
         """Delete all files that were downloaded."""
-        target_dir = self.output_dir
-        tree = list(filter(lambda item: item[0] != target_dir, os.walk(target_dir)))
-        dirs_to_remove = [d[0] for d in tree]
-        for d in dirs_to_remove:
-            rmtree(d)
+        if not os.path.exists(self.output_dir):
+            return
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    rmtree(entry.path)